@@ -11,6 +11,110 @@ import os
 from PIL import Image
 import numpy as np
 import gc
+import tempfile
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from functools import lru_cache
+
+# Size the editor and overlay panels are laid out for
+DISPLAY_SIZE = (868, 868)
+
+# File extensions picked up from the images folder
+IMAGE_EXTENSIONS = frozenset({".png", ".jpg", ".jpeg", ".bmp"})
+
+# Status labels shown next to the filename
+STATUS_SCRIBBLE = "🟢 Scribble exists"
+STATUS_NO_SCRIBBLE = "🔴 No scribble yet"
+
+# Background decoder for the images next to the current one. The table is
+# shared by all sessions, so one session may cancel another's prefetches
+_pool = ThreadPoolExecutor(max_workers=2)
+_prefetched: dict[str, Future] = {}
+
+
+@lru_cache(maxsize=8)
+def _load_display(path: str, target: tuple[int, int] = DISPLAY_SIZE) -> Image.Image:
+    """
+    Decode an image at (roughly) display resolution.
+
+    For JPEGs, ``draft`` lets libjpeg decode at 1/2, 1/4 or 1/8 scale while
+    keeping both sides at least as large as ``target``. Other formats ignore
+    the draft request and are decoded at full size.
+
+    Args:
+        path: Path to the image file.
+        target: Minimum size the decoded image should keep.
+
+    Returns:
+        The decoded RGB image.
+    """
+    with Image.open(path) as f:
+        f.draft("RGB", target)
+        return f.convert("RGB")
+
+
+@lru_cache(maxsize=32)
+def _load_scribble(path: str, stamp: tuple[int, int, int]) -> Image.Image:
+    """
+    Decode a saved scribble mask at panel height, in the mode it was stored in.
+
+    Masks only feed the overlay preview, so they are shrunk to the panel
+    height (NEAREST keeps the label values) before being cached. Conversion
+    to RGB is left to the overlay. ``stamp`` is part of the cache key so a
+    re-saved mask is decoded again.
+
+    Args:
+        path: Path to the scribble PNG.
+        stamp: (mtime in nanoseconds, size in bytes, save counter) of ``path``.
+            The counter covers re-saves within one coarse filesystem tick.
+
+    Returns:
+        The loaded mask image.
+    """
+    with Image.open(path) as f:
+        scale = DISPLAY_SIZE[1] / f.height
+        if scale < 1.0:
+            size = (max(1, round(f.width * scale)), DISPLAY_SIZE[1])
+            return f.resize(size, Image.NEAREST)
+        return f.copy()
+
+
+def _prefetch(paths: list[str]) -> None:
+    """
+    Start decoding the given images in the background.
+
+    Pending loads for images that are no longer in ``paths`` are cancelled.
+
+    Args:
+        paths: Image paths likely to be shown next.
+    """
+    for path in list(_prefetched):
+        fut = _prefetched.pop(path, None) if path not in paths else None
+        if fut is not None:
+            fut.cancel()
+    for path in paths:
+        if path not in _prefetched:
+            _prefetched[path] = _pool.submit(_load_display, path)
+
+
+def _get_display(path: str) -> Image.Image:
+    """
+    Return the display image for ``path``, reusing a prefetched decode if any.
+
+    Args:
+        path: Path to the image file.
+
+    Returns:
+        The decoded RGB image.
+    """
+    fut = _prefetched.get(path)
+    if fut is not None:
+        try:
+            return fut.result()
+        except CancelledError:
+            # Cancelled by a _prefetch call from another session
+            pass
+    return _load_display(path)
+
 
 def main():
     """
@@ -36,24 +140,50 @@ def main():
     os.makedirs(scribble_dir, exist_ok=True)
 
     # Gather your images
-    image_files = sorted(
-        f for f in os.listdir(image_dir)
-        if f.lower().endswith((".png", ".jpg", ".jpeg", ".bmp"))
-    )
+    with os.scandir(image_dir) as it:
+        image_files = sorted(
+            e.name for e in it
+            if e.is_file() and os.path.splitext(e.name)[1].lower() in IMAGE_EXTENSIONS
+        )
     if not image_files:
         raise ValueError(f"No images found in '{image_dir}'")
 
+    # Start decoding the first image while the rest of the UI is built
+    initial_name = image_files[0]
+    _prefetch([os.path.join(image_dir, initial_name)])
+
     # Count totals
     total_images = len(image_files)
-    scribble_files = sorted(
-        f for f in os.listdir(scribble_dir)
-        if f.lower().endswith(".png")
-    )
-    scribble_count = len(scribble_files)
+    # Masks are opened as "<base>.png". Other spellings of the extension
+    # (e.g. "x.PNG") only count if that path reaches them, which holds on
+    # case-insensitive filesystems; the stat is only paid for such names
+    with os.scandir(scribble_dir) as it:
+        scribble_files = sorted(
+            e.name for e in it
+            if e.is_file() and (
+                e.name.endswith(".png")
+                or (
+                    os.path.splitext(e.name)[1].lower() == ".png"
+                    and os.path.isfile(
+                        os.path.join(scribble_dir, os.path.splitext(e.name)[0] + ".png")
+                    )
+                )
+            )
+        )
+    # Basenames with a saved mask, kept in sync by save_scribbles
+    scribble_set = {os.path.splitext(f)[0] for f in scribble_files}
+    # Per-path save counter, part of the mask cache key
+    mask_versions: dict[str, int] = {}
+    scribble_count = len(scribble_set)
+
+    # Overlay previews are written here as JPEGs and served by path;
+    # the directory is removed when the process exits
+    preview_dir = tempfile.TemporaryDirectory(prefix="scribble-preview-")
 
     with gr.Blocks() as demo:
         idx_state = gr.State(0)  # current image index
 
+        @lru_cache(maxsize=1024)
         def _scribble_path(name: str) -> str:
             """
             Construct the expected scribble-mask filepath for a given image name.
@@ -75,9 +205,9 @@ def main():
                 name: Filename of the original image.
 
             Returns:
-                True if the mask file exists on disk, False otherwise.
+                True if a mask has been saved for this image, False otherwise.
             """
-            return os.path.exists(_scribble_path(name))
+            return os.path.splitext(name)[0] in scribble_set
 
         def _status_text(name: str) -> str:
             """
@@ -89,37 +219,86 @@ def main():
             Returns:
                 A green bullet if scribble exists, red if not.
             """
-            return "🟢 Scribble exists" if _has_scribble(name) else "🔴 No scribble yet"
+            return STATUS_SCRIBBLE if _has_scribble(name) else STATUS_NO_SCRIBBLE
+
+        def _saved_scribble(name: str) -> Image.Image | None:
+            """
+            Load the saved scribble mask for an image, if there is one.
+
+            A mask that disappeared from disk since it was recorded is dropped
+            from the scribble set and treated as missing.
+
+            Args:
+                name: Filename of the original image.
+
+            Returns:
+                The mask image, or None if no mask is saved.
+            """
+            if not _has_scribble(name):
+                return None
+            path = _scribble_path(name)
+            try:
+                st = os.stat(path)
+                return _load_scribble(
+                    path, (st.st_mtime_ns, st.st_size, mask_versions.get(path, 0))
+                )
+            except FileNotFoundError:
+                scribble_set.discard(os.path.splitext(name)[0])
+                return None
 
         def _overlay_image(
+            name: str,
             rgb_img: Image.Image,
             scribble_img: Image.Image | None,
             alpha: float = 0.7
-        ) -> Image.Image:
+        ) -> str:
             """
             Blend the original image with its scribble mask for preview.
 
+            The result is saved as a JPEG in the preview folder so Gradio can
+            serve the file directly instead of re-encoding an image object.
+
             Args:
+                name: Filename of the original image, used to name the preview.
                 rgb_img: The original RGB image.
-                scribble_img: The scribble mask as an RGB image (white strokes on gray).
+                scribble_img: The scribble mask (white strokes on gray), in any mode.
                 alpha: Blend factor (0 = only original, 1 = only mask).
 
             Returns:
-                A PIL.Image showing the overlay.
+                Path to the JPEG showing the overlay.
             """
+            # Blend at panel height; the panel cannot show more pixels anyway
+            scale = DISPLAY_SIZE[1] / rgb_img.height
+            if scale < 1.0:
+                size = (max(1, round(rgb_img.width * scale)), DISPLAY_SIZE[1])
+                rgb_img = rgb_img.resize(size, Image.BILINEAR)
             if scribble_img is None:
-                return rgb_img
-            return Image.blend(rgb_img, scribble_img, alpha=alpha)
-
-        # Load initial image + overlay
-        initial_name = image_files[0]
-        initial_img = Image.open(os.path.join(image_dir, initial_name)).convert("RGB")
-        initial_scribble = (
-            Image.open(_scribble_path(initial_name)).convert("RGB")
-            if _has_scribble(initial_name)
-            else None
-        )
-        initial_overlay = _overlay_image(initial_img, initial_scribble)
+                overlay = rgb_img
+            else:
+                # Resize before converting so only panel-sized buffers get copied
+                if scribble_img.size != rgb_img.size:
+                    scribble_img = scribble_img.resize(rgb_img.size, Image.NEAREST)
+                if scribble_img.mode != rgb_img.mode:
+                    scribble_img = scribble_img.convert(rgb_img.mode)
+                overlay = Image.blend(rgb_img, scribble_img, alpha=alpha)
+
+            # Write under a unique name and swap it into place, so a preview
+            # Gradio is still copying for another event is never half-written
+            path = os.path.join(preview_dir.name, f"{name}.jpg")
+            with tempfile.NamedTemporaryFile(
+                dir=preview_dir.name, suffix=".jpg", delete=False
+            ) as tmp:
+                try:
+                    overlay.save(tmp, "JPEG", quality=85, progressive=True)
+                except BaseException:
+                    tmp.close()
+                    os.unlink(tmp.name)
+                    raise
+            os.replace(tmp.name, path)
+            return path
+
+        # Load the initial mask; the image itself is still decoding
+        initial_scribble = _saved_scribble(initial_name)
 
         # UI layout
         with gr.Row():
@@ -132,21 +311,27 @@ def main():
                 interactive=False
             )
 
+        # Wait for the first image only now that the widgets above exist
+        initial_img = _get_display(os.path.join(image_dir, initial_name))
+        initial_overlay = _overlay_image(initial_name, initial_img, initial_scribble)
+        _prefetch([os.path.join(image_dir, f) for f in image_files[1:2]])
+
         with gr.Row():
             editor = gr.ImageEditor(
                 value={"background": initial_img, "layers": [], "composite": initial_img},
                 type="pil",
                 label="Draw Scribbles",
                 brush=gr.Brush(colors=["#000000", "#CCCCCC"], color_mode="fixed"),
-                height=868, scale=1.0, elem_id="custom-image-editor",
+                height=DISPLAY_SIZE[1], scale=1.0, elem_id="custom-image-editor",
                 layers=False,
                 placeholder="Draw your scribbles on the image to the left..."
             )
             existing_display = gr.Image(
                 value=initial_overlay,
                 label="Overlay: Image + Scribble",
+                type="filepath",
                 interactive=False,
-                height=868
+                height=DISPLAY_SIZE[1]
             )
 
         with gr.Row():
@@ -157,12 +342,13 @@ def main():
 
         # New: load any image by typing its filename
         def load_by_name(name: str, idx: int):
-            # if user typed something invalid, keep everything as-is and show error
+            # if user typed something invalid, go back to the first image
             if name not in image_files:
                 #return idx, gr.no_update, name, "❌ Image not found", gr.no_update
-                return navigate(0, 0)
-            # otherwise jump to that index (step=0 just reloads)
-            return navigate(image_files.index(name), 0)
+                new_idx, editor_state, _, mark, overlay = navigate(idx, -idx)
+                return new_idx, editor_state, image_files[new_idx], mark, overlay
+            # otherwise jump to that index (step=0 leaves the image as-is)
+            return navigate(idx, image_files.index(name) - idx)
 
 
         filename_display.submit(
@@ -196,28 +382,33 @@ def main():
 
             Args:
                 idx: Current index in image_files.
-                step: +1 to go next, -1 to go previous.
+                step: +1 to go next, -1 to go previous, 0 to stay.
 
             Returns:
                 Tuple of (new_idx, editor_state, filename, status_text, overlay_image).
+                All but the index are left untouched when step is 0 and the
+                image does not change (a submit of the name already shown).
             """
             new_idx = max(0, min(idx + step, len(image_files) - 1))
             name = image_files[new_idx]
-            
-            with Image.open(os.path.join(image_dir, name)) as f:
-                img = f.convert("RGB")
+            if step == 0 and new_idx == idx:
+                # The submitted name is already on screen along with its image
+                return new_idx, gr.update(), gr.update(), gr.update(), gr.update()
 
-            has_sb = _has_scribble(name)
-            if has_sb:
-                with Image.open(_scribble_path(name)) as sf:
-                    sb_img = sf.convert("RGB")
-            else:
-                sb_img = None
-        
-            overlay = _overlay_image(img, sb_img)
+            img = _get_display(os.path.join(image_dir, name))
+
+            sb_img = _saved_scribble(name)
+            overlay = _overlay_image(name, img, sb_img)
 
             editor_state = {"background": img, "layers": [], "composite": img}
 
+            _prefetch([
+                os.path.join(image_dir, image_files[i])
+                for i in (new_idx - 1, new_idx + 1)
+                if 0 <= i < len(image_files)
+            ])
+            # Status after loading, so a mask that vanished reads as missing.
+            # The filename is always rewritten: save_scribbles reads it back
             return new_idx, editor_state, name, _status_text(name), overlay
 
         prev_btn.click(
@@ -236,60 +427,71 @@ def main():
             Save the user’s scribble layers as a binary mask PNG.
 
             Args:
-                editor_value: Dictionary containing 'layers' list of PIL images.
+                editor_value: Dictionary containing 'layers' list of PIL images
+                    and the 'background' image being drawn on.
                 name: Current image filename to base the mask filename on.
 
             Returns:
                 A tuple of (status_message, new_overlay_image, updated_scribble_count).
             """
             layers = editor_value["layers"]
-            # Count before save
-            current = sorted(f for f in os.listdir(scribble_dir) if f.lower().endswith(".png"))
-            before_count = len(current)
-
             if not layers:
-                return "No scribbles to save.", None, str(before_count)
-
-            # Merge all layers
-            w, h = layers[0].size
-            canvas = Image.new("RGBA", (w, h), (0, 0, 0, 0))
-            for layer in layers:
-                canvas = Image.alpha_composite(canvas, layer.convert("RGBA"))
-
-            # Convert scribbles to white-on-transparent mask
-            gray_bg = Image.new("RGBA", (w, h), (128, 128, 128, 255))
-            flat = Image.alpha_composite(gray_bg, canvas).convert("RGB")
-            arr = np.array(flat)
-            bg_col = np.array([128, 128, 128])
-            black_col = np.array([0, 0, 0])
-            mask = np.any(arr != bg_col, axis=-1)
-            non_black = ~np.all(arr == black_col, axis=-1)
-            to_white = mask & non_black
-            arr[to_white] = [255, 255, 255]
-            final = Image.fromarray(arr)
-
-            # Save mask
-            base, _ = os.path.splitext(name)
-            outpath = os.path.join(scribble_dir, f"{base}.png")
-            final.save(outpath)
-
-            # Create new overlay preview
-            
+                return "No scribbles to save.", gr.update(), gr.update(), gr.update(), gr.update()
+
+            # Merge all layers: for opaque brush strokes "over" reduces to
+            # taking each pixel from the topmost layer drawn on there
+            # (np.asarray still copies each layer via tobytes(); RGBA layers
+            # skip convert() and a single layer skips the stack)
+            views = [
+                np.asarray(layer if layer.mode == "RGBA" else layer.convert("RGBA"))
+                for layer in layers
+            ]
+            if len(views) == 1:
+                rgba = views[0]
+            else:
+                stack = np.stack(views)
+                top = len(views) - 1 - (stack[::-1, ..., 3] > 0).argmax(axis=0)
+                rgba = np.take_along_axis(stack, top[None, ..., None], axis=0)[0]
+
+            # Classify pixels straight from the merged alpha channel:
+            # untouched -> gray, black strokes -> black, other strokes -> white.
+            # Each RGBA pixel is read as one little-endian uint32 (alpha in the
+            # top byte), so every test is one pass over H*W words
+            px = np.ascontiguousarray(rgba).view("<u4")[..., 0]
+            drawn = px > 0x00FFFFFF
+            out = np.where(drawn, np.uint8(255), np.uint8(128))
+            np.copyto(out, 0, where=drawn & ((px & 0x00FFFFFF) == 0))
+            final = Image.fromarray(out, "L")
+
+            # The editor shows a draft-decoded background, so scale the mask
+            # back up to the original resolution (only the header is read)
             with Image.open(os.path.join(image_dir, name)) as f:
-                orig = f.convert("RGB")
+                full_size = f.size
+            saved = final if final.size == full_size else final.resize(full_size, Image.NEAREST)
 
-
-            overlay = _overlay_image(orig, final)
+            # Save mask as single-channel grayscale (three levels, so not 1-bit)
+            base, _ = os.path.splitext(name)
+            outpath = _scribble_path(name)
+            saved.save(outpath, optimize=True)
+            scribble_set.add(base)
+            # Retire any cached decode of the previous mask at this path
+            mask_versions[outpath] = mask_versions.get(outpath, 0) + 1
+
+            # Create new overlay preview from the background already in the editor
+            orig = editor_value.get("background")
+            if orig is None:
+                orig = _get_display(os.path.join(image_dir, name))
+            elif orig.mode != "RGB":
+                orig = orig.convert("RGB")
+
+            overlay = _overlay_image(name, orig, final)
             # build a fresh editor state with no layers:
             new_editor = {"background": orig, "layers": [], "composite": orig}
 
-            # Count after save
-            updated = sorted(f for f in os.listdir(scribble_dir) if f.lower().endswith(".png"))
-            after_count = len(updated)
-
+            saved.close()
             final.close()                    # close the mask image
             gc.collect()                     # suggest Python free unreferenced memory
-            return f"Scribbles saved to: {outpath}", overlay, str(after_count), _status_text(initial_name), new_editor
+            return f"Scribbles saved to: {outpath}", overlay, str(len(scribble_set)), _status_text(name), new_editor
 
         save_btn.click(
             fn=save_scribbles,
@@ -297,7 +499,7 @@ def main():
             outputs=[status, existing_display, scribble_count_display, scribble_mark, editor]
         )
 
-    demo.launch()
+    demo.launch(allowed_paths=[preview_dir.name])
 
 
 if __name__ == "__main__":